@@ -0,0 +1,12 @@
+import os
+import sys
+
+from loguru import logger
+
+# Configure logging with Loguru once for every spider of the project.
+# Per-product DEBUG logs are only written when BLOOMY_DEBUG=1
+LOG_LEVEL = "DEBUG" if os.environ.get("BLOOMY_DEBUG") == "1" else "INFO"
+
+logger.remove()
+logger.add(sys.stderr, level=LOG_LEVEL)
+logger.add("logs/scraper.log", rotation="1 MB", level=LOG_LEVEL)
@@ -0,0 +1,128 @@
+import math
+import numbers
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+import orjson
+from itemadapter import ItemAdapter
+from scrapy.exporters import BaseItemExporter
+
+# Fixed OOXML boilerplate for a workbook with a single sheet
+CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+
+ROOT_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+WORKBOOK_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{sheet_name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+WORKBOOK_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+STYLES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+SHEET_HEADER_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+
+SHEET_FOOTER_XML = '</sheetData></worksheet>'
+
+# Control characters that XML 1.0 forbids even when escaped; Excel refuses a sheet containing them
+ILLEGAL_XML_CHARS_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _cell_xml(value):
+    """Format a single value as an OOXML <c> element."""
+    if value is None:
+        return '<c/>'
+    if isinstance(value, bool):
+        return '<c t="b"><v>{}</v></c>'.format(int(value))
+    if isinstance(value, numbers.Real):
+        if not math.isfinite(value):
+            return '<c/>'
+        return '<c><v>{}</v></c>'.format(value)
+    return '<c t="inlineStr"><is><t xml:space="preserve">{}</t></is></c>'.format(
+        escape(ILLEGAL_XML_CHARS_RE.sub('', str(value))))
+
+
+def write_xlsx_fast(path, columns, rows, sheet_name='bloomingdales'):
+    """Write rows straight to an .xlsx file by streaming sheet1.xml into the zip.
+
+    ``rows`` is any iterable of sequences ordered like ``columns``. Strings are
+    written as inline strings (minus control characters XML cannot hold),
+    ints/floats as numbers and bools as booleans; None and NaN are left as
+    empty cells.
+    """
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('[Content_Types].xml', CONTENT_TYPES_XML)
+        zf.writestr('_rels/.rels', ROOT_RELS_XML)
+        zf.writestr('xl/workbook.xml', WORKBOOK_XML.format(sheet_name=escape(sheet_name)))
+        zf.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS_XML)
+        zf.writestr('xl/styles.xml', STYLES_XML)
+
+        with zf.open('xl/worksheets/sheet1.xml', 'w') as raw:
+            write = raw.write
+            write(SHEET_HEADER_XML.encode('utf-8'))
+            write(('<row r="1">' + ''.join(map(_cell_xml, columns)) + '</row>').encode('utf-8'))
+            for r, row in enumerate(rows, 2):
+                write(('<row r="{}">'.format(r) + ''.join(map(_cell_xml, row)) + '</row>').encode('utf-8'))
+            write(SHEET_FOOTER_XML.encode('utf-8'))
+
+
+class OrjsonLinesItemExporter(BaseItemExporter):
+    """JSON lines feed exporter that serializes each item with orjson and writes the bytes directly."""
+
+    def __init__(self, file, **kwargs):
+        super().__init__(dont_fail=True, **kwargs)
+        self.file = file
+
+    def export_item(self, item):
+        adapter = ItemAdapter(item)
+        fields = self.fields_to_export or adapter.field_names()
+        self.file.write(orjson.dumps({field: adapter.get(field) for field in fields},
+                                     option=orjson.OPT_APPEND_NEWLINE))
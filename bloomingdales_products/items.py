@@ -3,10 +3,24 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
 
-import scrapy
+from dataclasses import dataclass
 
 
-class BloomingdalesProductsItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+@dataclass(slots=True)
+class BloomingdalesProductsItem:
+    # One product tile from a designer brand listing page.
+    # A slotted dataclass keeps the 14 fields in fixed slots instead of a per-item dict
+    website_name: str
+    competence_date: str
+    brand: str
+    product_code: str
+    country_code: str
+    currency_code: str
+    full_price: str
+    price: str
+    category1_code: float
+    category2_code: int
+    category3_code: bool
+    title: str
+    imageurl: str
+    itemurl: str
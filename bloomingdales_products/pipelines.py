@@ -1,65 +1,146 @@
-import pandas as pd
+import csv
+from itemadapter import ItemAdapter
 from loguru import logger
+import orjson
 import os
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pcsv
+import pyarrow.parquet as pq
+from scrapy.exceptions import DropItem
+
+from bloomingdales_products.exporters import write_xlsx_fast
+
+REQUIRED_COLUMNS = (
+    'website_name', 'competence_date', 'brand', 'product_code', 'country_code', 'currency_code',
+    'full_price', 'price', 'category1_code', 'category2_code', 'category3_code', 'title', 'imageurl', 'itemurl'
+)
+
+FEED_PATH = 'data/bloomingdales_products.jsonl'
+CSV_PATH = 'data/bloomingdales_products.csv'
+PARQUET_PATH = 'data/bloomingdales_products.parquet'
+EXCEL_PATH = 'data/bloomingdales_products.xlsx'
+
+# Low-cardinality text columns, dictionary-encoded so each distinct value is stored once
+# (read back by pandas as the category dtype)
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+
+# Column types of the exported table, in REQUIRED_COLUMNS order
+EXPORT_SCHEMA = pa.schema([
+    (column, {
+        'website_name': CATEGORY,
+        'competence_date': CATEGORY,
+        'brand': CATEGORY,
+        'country_code': CATEGORY,
+        'currency_code': CATEGORY,
+        'full_price': pa.float64(),
+        'price': pa.float64(),
+        'category1_code': pa.float64(),
+        'category2_code': pa.int64(),
+        'category3_code': pa.bool_(),
+    }.get(column, pa.string()))
+    for column in REQUIRED_COLUMNS
+])
+
+
+# Price columns, kept as scraped strings until the whole column is parsed at export time
+PRICE_COLUMNS = ('full_price', 'price')
+# Currency symbol and thousands separators
+PRICE_CLEAN_PATTERN = r'[$,]'
+# What is left of a valid price once cleaned
+PRICE_NUMBER_PATTERN = r'^(\d+\.?\d*|\.\d+)$'
+
+
+def parse_prices(values):
+    """Parse a column of listing prices such as '$1,100.00' or '$80 - $120' (first price of a range).
+
+    The whole column goes through Arrow's compute kernels in one pass; values that are not a price become None.
+    """
+    prices = pc.replace_substring_regex(pa.array(values, pa.string()), PRICE_CLEAN_PATTERN, '')
+    prices = pc.utf8_trim_whitespace(pc.list_element(pc.split_pattern(prices, '-', max_splits=1), 0))
+    prices = pc.if_else(pc.match_substring_regex(prices, PRICE_NUMBER_PATTERN), prices, pa.scalar(None, pa.string()))
+    return pc.cast(prices, pa.float64())
+
+
+# Parsers for the typed non-price columns when reading rows back from the CSV
+CSV_CONVERTERS = {
+    'category1_code': float,
+    'category2_code': lambda value: int(float(value)),
+    'category3_code': lambda value: value in ('true', 'True'),  # Arrow writes 'true', older exports 'True'
+}
+
+
+def read_csv_row(row):
+    """Turn a csv.DictReader row back into typed values ('' becomes None)."""
+    for column, value in row.items():
+        if value == '':
+            row[column] = None
+        elif column in CSV_CONVERTERS:
+            row[column] = CSV_CONVERTERS[column](value)
+    return row
+
+
+def export_deduplicated(feed_path=FEED_PATH, csv_path=CSV_PATH, parquet_path=PARQUET_PATH, excel_path=EXCEL_PATH):
+    """Merge this crawl's JSON lines feed into the CSV export by 'product_code' and mirror it to Parquet.
+
+    The Excel copy is only written when the EXPORT_XLSX environment variable is set.
+    """
+    # Keep the last row for each product, skipping header lines repeated by older appended feed runs
+    rows = {}
+    if os.path.exists(csv_path):
+        with open(csv_path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                code = row['product_code']
+                if code and code != 'product_code':
+                    rows[code] = read_csv_row(row)
+
+    # Items scraped in this crawl replace older rows
+    if os.path.exists(feed_path):
+        with open(feed_path, 'rb') as f:
+            for line in f:
+                row = orjson.loads(line)
+                if row.get('product_code'):
+                    rows[row['product_code']] = row
+
+    # Switch to one list per column with a fixed schema and drop the row dicts before converting,
+    # so Arrow skips per-row type inference and the rows are never held twice
+    columns = {c: [row.get(c) for row in rows.values()] for c in REQUIRED_COLUMNS}
+    del rows
+    for column in PRICE_COLUMNS:
+        columns[column] = parse_prices(columns[column])
+    table = pa.Table.from_pydict(columns, schema=EXPORT_SCHEMA)
+    del columns
+
+    # Every file is written next to the old one and swapped in with os.replace, never rewritten in place:
+    # a crash mid-write keeps the previous export, and hardlinked backups keep their contents
+
+    # Save to CSV with Arrow's native writer
+    pcsv.write_csv(table, csv_path + '.tmp', pcsv.WriteOptions(quoting_style='needed'))
+    os.replace(csv_path + '.tmp', csv_path)
+
+    # Parquet is the typed copy for analysis, compressed with zstd
+    pq.write_table(table, parquet_path + '.tmp', compression='zstd')
+    os.replace(parquet_path + '.tmp', parquet_path)
+
+    if os.environ.get('EXPORT_XLSX'):
+        # Stream rows straight into the xlsx zip instead of going through openpyxl
+        write_xlsx_fast(excel_path + '.tmp', REQUIRED_COLUMNS, zip(*(column.to_pylist() for column in table.columns)))
+        os.replace(excel_path + '.tmp', excel_path)
+
+    logger.info('Data has been successfully exported to CSV and Parquet files without duplicates.')
+
 
 class BloomingdalesExcelPipeline:
     def __init__(self):
-        self.items = []
+        # Product codes seen in this crawl. Products already in the CSV are scraped again on purpose:
+        # export_deduplicated keeps the latest row, so prices, ratings and competence_date stay current
+        self._seen = set()
 
     def process_item(self, item, spider):
-        # Append each item to the list
-        self.items.append(item)
+        # Drop products listed twice in this crawl before they reach the JSON lines feed
+        code = ItemAdapter(item).get('product_code')
+        if not code or code in self._seen:
+            raise DropItem(f"Duplicate or missing product_code: {code}", log_level='DEBUG')
+        self._seen.add(code)
         return item
 
-    def close_spider(self, spider):
-    # Convert the items to a DataFrame
-        df = pd.DataFrame(self.items)
-
-        # Ensure all required columns exist, fill missing columns with None (or any default value)
-        required_columns = [
-            'website_name', 'competence_date', 'brand', 'product_code', 'country_code', 'currency_code',
-            'full_price', 'price', 'category1_code', 'category2_code', 'category3_code', 'title', 'imageurl', 'itemurl'
-        ]
-        for column in required_columns:
-            if column not in df.columns:
-                df[column] = None
-
-<<<<<<< HEAD
-        # Reorder the DataFrame columns
-        df = df[required_columns]
-
-        # Remove duplicates based on 'product_code'
-        df = df.drop_duplicates(subset='product_code')
-
-        # Check if files already exist
-        csv_path = 'data/bloomingdales_products.csv'
-        excel_path = 'data/bloomingdales_products.xlsx'
-
-        if os.path.exists(csv_path):
-            existing_df = pd.read_csv(csv_path)
-            df = pd.concat([existing_df, df]).drop_duplicates(subset='product_code', keep='last')
-        
-        if os.path.exists(excel_path):
-            existing_df = pd.read_excel(excel_path)
-            df = pd.concat([existing_df, df]).drop_duplicates(subset='product_code', keep='last')
-
-        # Save to CSV, overwriting the existing file
-        df.to_csv(csv_path, index=False)
-        # Save to Excel, overwriting the existing file
-        df.to_excel(excel_path, index=False)
-
-        logger.info('Data has been successfully exported to CSV and Excel files without duplicates.')
-=======
-        # Add missing columns with None if they don't exist in the DataFrame
-        for column in required_columns:
-            if column not in df.columns:
-                df[column] = None
-
-        # Reorder the DataFrame columns
-        df = df[required_columns]
-
-        # Export to Excel
-        df.to_excel('bloomingdales_products.xlsx', index=False)
-        logger.info('Data has been successfully exported to bloomingdales_products.xlsx')
-
->>>>>>> a427959e3d1da05a2f05a0565a6a8c0793d4cbe5
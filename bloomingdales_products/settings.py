@@ -7,6 +7,9 @@
 #     https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 #     https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+# Scrapy's own per-request DEBUG lines only with BLOOMY_DEBUG=1, like the Loguru logs
+from bloomingdales_products import LOG_LEVEL  # noqa: F401
+
 BOT_NAME = "bloomingdales_products"
 
 SPIDER_MODULES = ["bloomingdales_products.spiders"]
@@ -102,3 +105,6 @@ ITEM_PIPELINES = {
 REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 FEED_EXPORT_ENCODING = "utf-8"
+FEED_EXPORTERS = {
+    "jsonlines": "bloomingdales_products.exporters.OrjsonLinesItemExporter",
+}
@@ -1,17 +1,66 @@
 import scrapy
-import pandas as pd
 from datetime import datetime
+import hashlib
+import math
 from loguru import logger
 import os
-import random
 import re  # Import regex for text parsing
+from urllib.parse import urljoin
 from scrapy import signals
+from scrapy.utils.response import get_base_url
 from pydispatch import dispatcher
+from lxml import etree
 
-# Configure logging with Loguru
-logger.add("logs/scraper.log", rotation="1 MB", level="DEBUG")
+from bloomingdales_products.items import BloomingdalesProductsItem
+from bloomingdales_products.pipelines import FEED_PATH, REQUIRED_COLUMNS, export_deduplicated
+from bloomingdales_products.xpaths import first, has_class
+
+# Loguru sinks are configured once in the package (see bloomingdales_products/__init__.py)
 logger.info("Starting the Bloomingdale's scraper...")
 
+
+# Brand links and names on the all-designers page
+XPATH_BRAND_LINKS = etree.XPath('//div[@class="brand-items-grid"]//ul/li/a/@href', smart_strings=False)
+XPATH_BRAND_NAMES = etree.XPath('//div[@class="brand-items-grid"]//ul/li/a/text()', smart_strings=False)
+
+# Selectors used for every product tile, compiled once and evaluated directly on lxml nodes.
+# Hand-written equivalents of the original CSS selectors, so no CSS-to-XPath translation is involved
+XPATH_TOTAL_PRODUCTS = etree.XPath(f'//*[@id="app-wrapper"]/div/*[3][self::div]/div[{has_class("results-found-message", "total-results-found")}]/div/span/text()', smart_strings=False)
+XPATH_PRODUCTS = etree.XPath('//*[@id="app-wrapper"]/div/*[3][self::div]/ul/li')
+# Product links of every tile on the page at once, used to fingerprint the listing
+XPATH_PAGE_URLS = etree.XPath(f'//*[@id="app-wrapper"]/div/*[3][self::div]/ul/li//div[{has_class("product-description", "margin-top-xxs")}]//*[1][self::div]//a/@href', smart_strings=False)
+# The product link is walked to once per tile; its href and the product name are then read from that node
+XPATH_LINK = etree.XPath(f'(.//div[{has_class("product-description", "margin-top-xxs")}]//*[1][self::div]//a)[1]')
+XPATH_NAME = etree.XPath(f'.//div[{has_class("product-name")}]/text()', smart_strings=False)
+XPATH_BESTSELLER = etree.XPath(f'.//div[{has_class("eyebrow", "flexText")}]/text()', smart_strings=False)
+XPATH_RATING = etree.XPath(f'.//div[{has_class("reviewlet-spacing")}]//div//fieldset/@aria-label', smart_strings=False)
+XPATH_IMAGE = etree.XPath(f'.//div[{has_class("v-scroller")}]//ul//li[{has_class("active")}]//img/@data-src', smart_strings=False)
+
+# Discounted price, only matched when the tile carries a "Now"/"Sale" label
+XPATH_DISCOUNT_PRICE = etree.XPath('.//div[@class="show-percent-off"][span/span[contains(text(),"Now") or contains(text(),"Sale")]]/span[1]/text()', smart_strings=False)
+# Full price: the struck-through price of a discounted tile, the regular price otherwise
+XPATH_STRIKE_PRICE = etree.XPath('.//div[@class="pricing"]//span[contains(@class,"price-strike")]/text()', smart_strings=False)
+XPATH_REGULAR_PRICE = etree.XPath('.//div[@class="pricing"]//span[contains(@class,"price-reg")]/text()', smart_strings=False)
+
+# Listing pages scraped per brand at most
+MAX_PAGES = 7
+
+# Regexes used per page and per product, compiled once
+NONDIGIT_RE = re.compile(r'\D')
+PAGINATION_RE = re.compile(r'(buy/[^?]+)(\?)')
+RATING_RE = re.compile(r"Rated (\d+\.?\d*) stars with (\d+) reviews")
+PRODUCT_ID_RE = re.compile(r'[?&]ID=([^&#]+)')  # ID query parameter, wherever it sits in the query string
+
+# Fallback image lookup for tiles without a lazy-loaded image: one union walked once, first match in document order
+XPATH_FALLBACK_IMAGE = etree.XPath(
+    f'(.//picture[{has_class("main-picture")}]/img/@src'
+    f' | .//picture[{has_class("main-picture")}]/source[1]/@srcset'
+    f' | .//div[{has_class("picture-container")}]/picture/source/@srcset'
+    f' | .//div[{has_class("v-scroller")}]//li[{has_class("active")}]//img/@data-src'
+    f' | .//div[{has_class("v-scroller")}]//li[{has_class("active")}]//img/@src)[1]',
+    smart_strings=False,
+)
+
 class BloomingdalesSpider(scrapy.Spider):
     name = "bloomingdales"
     allowed_domains = ["bloomingdales.com"]
@@ -26,13 +75,42 @@ class BloomingdalesSpider(scrapy.Spider):
     ]
 
     custom_settings = {
-        'DOWNLOAD_DELAY': random.uniform(1, 3),  # Control the number of concurrent requests
+        # Let AutoThrottle adapt the delay to the server's latency instead of a fixed per-request sleep;
+        # Scrapy jitters each delay between 0.5x and 1.5x DOWNLOAD_DELAY
+        'AUTOTHROTTLE_ENABLED': True,
+        'AUTOTHROTTLE_START_DELAY': 1.0,
+        'AUTOTHROTTLE_MAX_DELAY': 10.0,
+        'AUTOTHROTTLE_TARGET_CONCURRENCY': 4.0,
+        # Hard cap on in-flight requests to bloomingdales.com, to stay clear of its bot detection
+        'CONCURRENT_REQUESTS': 16,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 4,
+        'DOWNLOAD_DELAY': 1.0,  # Floor for AutoThrottle's adaptive delay
+        'RANDOMIZE_DOWNLOAD_DELAY': True,
+        # Rotate the User-Agent per request (replaces Scrapy's fixed USER_AGENT header)
+        'DOWNLOADER_MIDDLEWARES': {
+            'scrapy.downloadermiddlewares.useragent.UserAgentMiddleware': None,
+            'bloomingdales_products.middlewares.RandomUserAgentMiddleware': 400,
+        },
+        # Multiplex requests to the single host over one HTTP/2 connection (needs Twisted[http2])
+        'DOWNLOAD_HANDLERS': {
+            'https': 'scrapy.core.downloader.handlers.http2.H2DownloadHandler',
+        },
+        # Development only (BLOOMY_HTTPCACHE=1): replay listing pages from disk for a day on re-runs. Off by default,
+        # since a cached page would export old prices under a new competence_date. Responses are gzip/brotli-decoded
+        # by Scrapy's HttpCompressionMiddleware, enabled by default; brotli needs the brotli package.
+        # One dbm database per spider instead of a directory of files per URL, and block/error responses are never
+        # stored, so retries fetch them again
+        'HTTPCACHE_ENABLED': os.environ.get('BLOOMY_HTTPCACHE') == '1',
+        'HTTPCACHE_STORAGE': 'scrapy.extensions.httpcache.DbmCacheStorage',
+        'HTTPCACHE_EXPIRATION_SECS': 86400,
+        'HTTPCACHE_IGNORE_HTTP_CODES': [403, 429, 500, 502, 503, 504],
+        # This crawl's items, serialized with orjson and merged into the CSV/Parquet exports once the feed is closed
         'FEEDS': {
-            'data/bloomingdales_products.csv': {
-                'format': 'csv',
-                'encoding': 'utf8',
+            FEED_PATH: {
+                'format': 'jsonlines',
+                'fields': list(REQUIRED_COLUMNS),
+                'overwrite': True,
                 'store_empty': False,
-                'indent': 4,
             },
         },
     }
@@ -40,33 +118,45 @@ class BloomingdalesSpider(scrapy.Spider):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.failed_image_products = []  # Store products with failed image URLs
-        self.all_scraped_items = []  # Store all scraped items for later processing
+        self.seen_pages = set()  # Digests of the product listings already parsed
+        self.competence_date = datetime.now().strftime('%Y-%m-%d')  # Same date for every item of the crawl
+        # Fields shared by every item of the crawl, built once
+        self.constant_fields = {
+            'website_name': 'www.bloomingdales.com',
+            'competence_date': self.competence_date,
+            'country_code': 'USA',
+            'currency_code': 'USD',
+        }
         dispatcher.connect(self.spider_closed, signals.spider_closed)  # Connect signal to close spider
+        dispatcher.connect(self.feed_exporter_closed, signals.feed_exporter_closed)  # Feed file is complete
 
     def parse(self, response):
         """Initial parsing logic to extract brand links."""
-        brand_links = response.xpath('//div[@class="brand-items-grid"]//ul/li/a/@href').getall()
-        brand_names = response.xpath('//div[@class="brand-items-grid"]//ul/li/a/text()').getall()
+        root = response.selector.root
+        brand_links = XPATH_BRAND_LINKS(root)
+        brand_names = XPATH_BRAND_NAMES(root)
 
         if not brand_links:
             logger.warning(f"No brand links found on {response.url}")
         else:
             logger.info(f"Found {len(brand_links)} brand links on {response.url}")
 
-        for link, brand_name in zip(brand_links, brand_names):  # Limit to 5 for testing
+        for request, brand_name in zip(response.follow_all(brand_links, self.parse_designer_brand), brand_names):
             logger.info(f"Scraping brand: {brand_name}")
-            yield response.follow(link, self.parse_designer_brand, meta={'brand_name': brand_name})
+            request.meta['brand_name'] = brand_name
+            yield request
 
     def parse_designer_brand(self, response):
         """Extract products for designer brands and handle pagination."""
         brand_name = response.meta.get('brand_name')
 
-        # Extract total number of products from the page (for logging purposes only)
-        total_products_text = response.css('#app-wrapper > div > div:nth-child(3) > div.results-found-message.total-results-found > div > span::text').get()
+        # Extract total number of products from the page (used to size the pagination)
+        root = response.selector.root
+        total_products_text = first(XPATH_TOTAL_PRODUCTS(root))
         
         # Clean the extracted text to get only the number of products (e.g., remove '(26 items)')
         if total_products_text:
-            total_products_cleaned = re.sub(r'\D', '', total_products_text)  # Remove non-numeric characters
+            total_products_cleaned = NONDIGIT_RE.sub('', total_products_text)  # Remove non-numeric characters
             total_products = int(total_products_cleaned) if total_products_cleaned.isdigit() else 0
         else:
             total_products = 0
@@ -74,7 +164,7 @@ class BloomingdalesSpider(scrapy.Spider):
         logger.info(f"Total products listed for {brand_name}: {total_products}")
 
         # Scrape products on the current page
-        product_elements = response.css('#app-wrapper > div > div:nth-child(3) > ul > li')
+        product_elements = XPATH_PRODUCTS(root)
         scraped_products_count = len(product_elements)
         logger.info(f"Scraped {scraped_products_count} products on current page for {brand_name}")
 
@@ -83,129 +173,102 @@ class BloomingdalesSpider(scrapy.Spider):
             logger.warning(f"No products found on page {response.url} for {brand_name}. Moving to the next brand.")
             return  # Skip pagination and move to the next brand
 
-        # Scrape each product on the current page
+        # Skip listings of this brand whose products were all parsed already (e.g. a Pageindex past the last page
+        # serving the last page again); pagination stops with them. The brand is part of the key, so a brand
+        # listing the same products as another one is still scraped and paginated
+        page_key = '\n'.join([brand_name or '', *XPATH_PAGE_URLS(root)])
+        page_digest = hashlib.blake2b(page_key.encode('utf-8'), digest_size=8).digest()
+        if page_digest in self.seen_pages:
+            logger.info(f"Page {response.url} repeats an already scraped listing for {brand_name}. Moving to the next brand.")
+            return
+        self.seen_pages.add(page_digest)
+
+        # Scrape each product on the current page, straight on the lxml nodes, and hand the page's items over at once
+        items = []
+        base_url = get_base_url(response)  # Resolved once for the whole page
         for product in product_elements:
-            product_url = product.css('div.product-description.margin-top-xxs div:nth-child(1) a::attr(href)').get()
-            product_name = product.css('div.product-description.margin-top-xxs div:nth-child(1) a div.product-name::text').get()
+            link = first(XPATH_LINK(product))
+            product_url = link.get('href') if link is not None else None
+            product_name = first(XPATH_NAME(link)) if link is not None else None
 
-            bestseller_selector = product.css('div.eyebrow.flexText::text').get()
+            bestseller_selector = first(XPATH_BESTSELLER(product))
             best_seller_status = True if bestseller_selector and "Best Seller" in bestseller_selector else False
 
-            rating_info = product.css('div.reviewlet-spacing div fieldset::attr(aria-label)').get()
+            rating_info = first(XPATH_RATING(product))
             stars, reviews = self.extract_rating_and_reviews(rating_info) if rating_info else (None, None)
 
-            image_url = product.css('div.v-scroller ul li.active img::attr(data-src)').get()
+            image_url = first(XPATH_IMAGE(product))
             if not image_url:
-                image_url = self.extract_image_url(product, response)
+                image_url = self.extract_image_url(product)
 
             full_price, discounted_price = self.get_price(product)
-            product_code = product_url.split("?ID=")[1].split("&")[0] if product_url else None
-
             if product_url:
-                item = {
-                    'website_name': 'www.bloomingdales.com',
-                    'competence_date': datetime.now().strftime('%Y-%m-%d'),
-                    'brand': brand_name,
-                    'product_code': product_code,
-                    'country_code': 'USA',
-                    'currency_code': 'USD',
-                    'full_price': full_price,
-                    'price': discounted_price,
-                    'category1_code': stars,
-                    'category2_code': reviews,
-                    'category3_code': best_seller_status,
-                    'title': product_name.strip() if product_name else None,
-                    'imageurl': image_url,
-                    'itemurl': response.urljoin(product_url)
-                }
-                self.all_scraped_items.append(item)
-                yield item
-
-        # Pagination logic: ensure the spider attempts to scrape up to 10 pages
+                product_id = PRODUCT_ID_RE.search(product_url)
+                product_code = product_id.group(1) if product_id else None
+                items.append(BloomingdalesProductsItem(
+                    **self.constant_fields,
+                    brand=brand_name,
+                    product_code=product_code,
+                    full_price=full_price,
+                    price=discounted_price,
+                    category1_code=stars,
+                    category2_code=reviews,
+                    category3_code=best_seller_status,
+                    title=product_name.strip() if product_name else None,
+                    imageurl=image_url,
+                    itemurl=urljoin(base_url, product_url),
+                ))
+        yield from items
+
+        # Pagination logic: scrape up to MAX_PAGES pages per brand
         current_page = response.meta.get('current_page', 1)
-        if current_page < 7:  # Scrape up to 10 pages
+        if current_page == 1 and total_products:
+            # The page count is known from the first page, so queue every remaining page at once; they download
+            # while earlier pages are parsed, at a lower priority so other brands' first pages still go first
+            page_count = math.ceil(total_products / scraped_products_count)
+            last_page = min(page_count, MAX_PAGES)
+            for next_page in range(2, last_page + 1):
+                next_page_url = PAGINATION_RE.sub(rf'\1/Pageindex/{next_page}\2', response.url)
+                yield response.follow(next_page_url, self.parse_designer_brand, priority=-1,
+                                      meta={'brand_name': brand_name, 'current_page': next_page, 'last_page': last_page})
+            logger.info(f"Queued {last_page - 1} more pages for brand {brand_name}")
+            if page_count > MAX_PAGES:
+                logger.info(f"{brand_name} has {page_count} pages; only the first {MAX_PAGES} are scraped.")
+        elif 'last_page' not in response.meta and current_page < MAX_PAGES:
+            # Total unknown: follow the pages one at a time
             next_page = current_page + 1
-            next_page_url = re.sub(r'(buy/[^?]+)(\?)', rf'\1/Pageindex/{next_page}\2', response.url)
+            next_page_url = PAGINATION_RE.sub(rf'\1/Pageindex/{next_page}\2', response.url)
 
             logger.info(f"Scraping page {next_page} for brand {brand_name}")
             yield response.follow(next_page_url, self.parse_designer_brand, meta={'brand_name': brand_name, 'current_page': next_page})
-        else:
-            logger.info(f"Reached the maximum of 7 pages for {brand_name}. Moving to the next brand.")
-
-
-
-    def extract_image_url(self, product, response):
-        selectors = [
-            'picture.main-picture > img::attr(src)',
-            'picture.main-picture > source::attr(srcset)',
-            '//picture[@class="main-picture"]/img/@src',
-            '//picture[@class="main-picture"]/source[1]/@srcset',
-            '//div[@class="picture-container"]/picture/source[@media="(max-width: 599px)"]/@srcset',
-            '//div[@class="picture-container"]/picture/source[@media="(min-width: 600px) and (max-width: 1023px)"]/@srcset',
-            '//div[@class="picture-container"]/picture/source[@media="(min-width: 1024px) and (max-width: 1279px)"]/@srcset',
-            '//div[@class="picture-container"]/picture/source[@media="(min-width: 1280px) and (max-width: 1599px)"]/@srcset',
-            '//div[@class="picture-container"]/picture/source[@media="(min-width: 1600px)"]/@srcset',
-            '#product-thumbnail-5096784 > a > div > div > div > div > div > div.v-scroller > ul > li.active.cell.small-12.slideshow-item > div > picture > img::attr(src)',
-            '/html/body/div[3]/main/div/div[3]/ul/li[1]/div/div/div[1]/div/a/div/div/div/div/div/div[2]/ul/li[2]/div/picture/img/@src',
-            '/html/body/div[3]/main/div/div[3]/ul/li[1]/div/div/div[1]/div/a/div/div/div/div/div/div[2]/ul/li[2]/div/picture/source[2]/@srcset',
-            '#product-thumbnail-5096784 > a > div > div > div > div > div > div.v-scroller > ul > li.active.cell.small-12.slideshow-item > div > picture > source:nth-child(2)::attr(srcset)',
-            '/html/body/div[3]/main/div/div[3]/ul/li[1]/div/div/div[1]/div/a/div/div/div/div/div/div[2]/ul/li[2]/div/picture/source[1]/@srcset'
-        ]
-        image_url = None
-        for selector in selectors:
-            if '::attr' in selector:
-                image_url = response.css(selector).get()
-            else:
-                image_url = response.xpath(selector).get()
-            if image_url:
-                logger.info(f"Image URL found: {image_url}")
-                break
+        elif 'last_page' not in response.meta and current_page == MAX_PAGES:
+            logger.info(f"Reached the maximum of {MAX_PAGES} pages for {brand_name}. Moving to the next brand.")
+
+
+
+    def extract_image_url(self, product):
+        image_url = first(XPATH_FALLBACK_IMAGE(product))
+        if image_url:
+            logger.debug("Image URL found: {}", image_url)
         return image_url
 
     def extract_rating_and_reviews(self, rating_text):
-        pattern = re.compile(r"Rated (\d+\.?\d*) stars with (\d+) reviews")
-        match = pattern.search(rating_text)
+        match = RATING_RE.search(rating_text)
         if match:
             return float(match.group(1)), int(match.group(2))
         return None, None
 
     def get_price(self, product):
-        full_price = discounted_price = None
-        discount_price_text = product.xpath('.//div[@class="show-percent-off"]/span/span[contains(text(),"Now") or contains(text(),"Sale")]/text()').get()
-        if discount_price_text:
-            discounted_price_xpath = product.xpath('.//div[@class="show-percent-off"]/span[1]/text()').get()
-            discounted_price = self.convert_price_to_float(discounted_price_xpath)
-            full_price_xpath = product.xpath('.//div[@class="pricing"]//span[contains(@class,"price-strike")]/text()').get()
-            full_price = self.convert_price_to_float(full_price_xpath)
-        else:
-            full_price_xpath = product.xpath('.//div[@class="pricing"]//span[contains(@class,"price-reg")]/text()').get()
-            full_price = self.convert_price_to_float(full_price_xpath)
+        # Raw price strings, parsed to floats once when the CSV is exported (see pipelines.parse_prices)
+        discounted_price = first(XPATH_DISCOUNT_PRICE(product))
+        full_price = first((XPATH_STRIKE_PRICE if discounted_price else XPATH_REGULAR_PRICE)(product))
         return full_price, discounted_price
 
-    def convert_price_to_float(self, price_str):
-        if not price_str:
-            return None
-        try:
-            price_str = price_str.replace("$", "").replace(",", "").strip()
-            return float(price_str.split("-")[0].strip())
-        except ValueError:
-            logger.error(f"Error converting price to float: {price_str}")
-            return None
-      
-        
-
     def spider_closed(self, spider):
         """Runs when the spider is closed."""
         logger.info("Spider closed. Starting post-scrape tasks...")
 
-        # Load the data from CSV, deduplicate, and save again
-        df = pd.read_csv('data/bloomingdales_products.csv')
-
-        # Remove duplicates based on 'product_code'
-        df = df.drop_duplicates(subset='product_code')
-
-        # Overwrite CSV and Excel files
-        df.to_csv('data/bloomingdales_products.csv', index=False)
-        df.to_excel('data/bloomingdales_products.xlsx', index=False)
-
-        logger.info("CSV and Excel files saved successfully without duplicates.")
\ No newline at end of file
+    def feed_exporter_closed(self):
+        """Runs once the JSON lines feed has been written and closed."""
+        # Merge this crawl's items into the CSV and write the Parquet/Excel copies
+        export_deduplicated()
@@ -1,44 +1,112 @@
 import scrapy
+import errno
+import orjson
 import pandas as pd
 import os
 import shutil
-import time
+from concurrent.futures import ThreadPoolExecutor
 from scrapy import signals
 from scrapy.crawler import CrawlerProcess
 from scrapy.signalmanager import dispatcher
 from loguru import logger
+from lxml import etree
+
+from bloomingdales_products import LOG_LEVEL
+from bloomingdales_products.pipelines import CSV_PATH, EXCEL_PATH, PARQUET_PATH
+from bloomingdales_products.xpaths import has_class
+
+# Outputs of the image scraper; Parquet is what the missing-URL check reads back
+UPDATED_CSV_PATH = 'data/updated/bloomingdales_products_updated.csv'
+UPDATED_PARQUET_PATH = 'data/updated/bloomingdales_products_updated.parquet'
+UPDATED_EXCEL_PATH = 'data/updated/bloomingdales_products_updated.xlsx'
+# Image URLs found so far, one JSON line per product, merged into the frame once in closed()
+PATCH_PATH = 'data/updated/patch.jsonl'
+
+# How many times a product page without images is requested again
+IMAGE_RETRY_TIMES = 2
+
+# How many extra crawls are started for products still missing an image once a crawl closes
+MISSING_URL_RETRY_ROUNDS = 2
+
+# CrawlerProcess used to start those crawls, only set when run as a module
+# (python -m bloomingdales_products.spiders.bloomingdales_image_scraper, from the repository root)
+process = None
+
+# The product images of the page in one walk, in document order: the first main picture's img and first source,
+# and the per-size sources of the first picture in the container (not the rest of the gallery)
+XPATH_IMAGES = etree.XPath(
+    f'(//picture[{has_class("main-picture")}])[1]/img/@src'
+    f' | (//picture[{has_class("main-picture")}])[1]/source[1]/@srcset'
+    f' | (//div[{has_class("picture-container")}]/picture)[1]/source/@srcset',
+    smart_strings=False,
+)
+
+
+def link_backup(path, backup_path):
+    """Back up an export with a hardlink instead of copying its bytes.
+
+    The exports are always replaced by a new file, never rewritten in place, so the link keeps the old contents.
+    Falls back to a copy when the backup folder is on another filesystem.
+    """
+    if not os.path.exists(path):
+        return
+    if os.path.exists(backup_path):
+        os.unlink(backup_path)
+    try:
+        os.link(path, backup_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.copy2(path, backup_path)
+
 
 class BloomingdalesImageScraper(scrapy.Spider):
     name = "bloomingdales_image_scraper"
     allowed_domains = ["bloomingdales.com"]
 
     custom_settings = {
-        'CONCURRENT_REQUESTS': 16,
+        # Every request goes to bloomingdales.com, so the per-domain budget is the effective concurrency limit
+        # (the global CONCURRENT_REQUESTS default of 16 is never reached); 8 stays clear of its rate limiting
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 8,
+        'DNS_TIMEOUT': 15,
+        'DOWNLOAD_TIMEOUT': 30,  # Give up on a hung product page early and let RETRY_TIMES handle it
         'RETRY_TIMES': 5,
         'DOWNLOAD_DELAY': 1.0,
         'AUTOTHROTTLE_ENABLED': True,
-        'HTTPCACHE_ENABLED': True,
-        'LOG_LEVEL': 'DEBUG'
+        # No HTTP cache: only products still missing an image are requested, so a cached page would be
+        # the very response that had no image the last time
+        'HTTPCACHE_ENABLED': False,
+        'LOG_LEVEL': LOG_LEVEL,
+        # Rotate the User-Agent per request (replaces Scrapy's fixed USER_AGENT header)
+        'DOWNLOADER_MIDDLEWARES': {
+            'scrapy.downloadermiddlewares.useragent.UserAgentMiddleware': None,
+            'bloomingdales_products.middlewares.RandomUserAgentMiddleware': 400,
+        },
+        # Multiplex the product page requests over one HTTP/2 connection instead of a TLS handshake
+        # per connection (needs Twisted[http2], like the product spider)
+        'DOWNLOAD_HANDLERS': {
+            'https': 'scrapy.core.downloader.handlers.http2.H2DownloadHandler',
+        },
     }
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, retry_round=0, **kwargs):
         super().__init__(*args, **kwargs)
+        self.retry_round = int(retry_round)  # 0 for the first crawl, then one more per retry crawl
 
-        # Create backup folder if it doesn't exist and save a copy of the current CSV and Excel files
+        # Create backup folder if it doesn't exist and save a copy of the current CSV, Parquet and Excel files
         if not os.path.exists('data/backup'):
             os.makedirs('data/backup')
 
-        if os.path.exists('data/bloomingdales_products.csv'):
-            shutil.copy2('data/bloomingdales_products.csv', 'data/backup/bloomingdales_products_backup.csv')
-        if os.path.exists('data/bloomingdales_products.xlsx'):
-            shutil.copy2('data/bloomingdales_products.xlsx', 'data/backup/bloomingdales_products_backup.xlsx')
+        link_backup(CSV_PATH, 'data/backup/bloomingdales_products_backup.csv')
+        link_backup(PARQUET_PATH, 'data/backup/bloomingdales_products_backup.parquet')
+        link_backup(EXCEL_PATH, 'data/backup/bloomingdales_products_backup.xlsx')
 
-        # Load the Excel file
+        # Load the Parquet export (the Excel copy is only written on demand)
         try:
-            self.df = pd.read_excel('data/bloomingdales_products.xlsx')
-            logger.info(f"Loaded Excel file with {len(self.df)} total products.")
+            self.df = pd.read_parquet(PARQUET_PATH)
+            logger.info(f"Loaded Parquet file with {len(self.df)} total products.")
         except Exception as e:
-            logger.error(f"Error loading Excel file: {e}")
+            logger.error(f"Error loading Parquet file: {e}")
             self.df = pd.DataFrame()
 
         # Filter products to scrape based on missing image URLs
@@ -51,6 +119,10 @@ class BloomingdalesImageScraper(scrapy.Spider):
         if not os.path.exists('data/updated'):
             os.makedirs('data/updated')
 
+        # Patch file, opened on the first update. Appended to rather than truncated, so updates of a crashed run
+        # are still merged at the next close
+        self.patch_file = None
+
     def start_requests(self):
         base_url = "https://www.bloomingdales.com"
 
@@ -58,20 +130,17 @@ class BloomingdalesImageScraper(scrapy.Spider):
             logger.warning("No products to scrape. Stopping spider.")
             return
 
-        for index, row in self.products_to_scrape.iterrows():
-            product_url = row['itemurl']
-            product_code = row['product_code']
+        # Plain column arrays instead of a Series per row; relative URLs are prefixed in one pass
+        urls = self.products_to_scrape['itemurl']
+        urls = urls.where(urls.str.startswith('http', na=True), base_url + urls)
 
-            logger.debug(f"Processing product: {product_code}, URL: {product_url}")
-
-            if not product_url.startswith('http'):
-                product_url = base_url + product_url
-                logger.debug(f"Updated relative URL to: {product_url}")
+        for product_url, product_code in zip(urls.to_numpy(), self.products_to_scrape['product_code'].to_numpy()):
+            logger.debug("Processing product: {}, URL: {}", product_code, product_url)
 
             yield scrapy.Request(
                 url=product_url,
                 callback=self.parse,
-                meta={'index': index, 'product_code': product_code},
+                meta={'product_code': product_code},
                 errback=self.handle_error
             )
 
@@ -79,82 +148,110 @@ class BloomingdalesImageScraper(scrapy.Spider):
         request = failure.request
         product_code = request.meta.get('product_code', 'Unknown')
         logger.error(f"Network error or invalid response for product {product_code}. Details: {failure}")
-        if not self.df.empty:
-            self.df.at[request.meta['index'], 'imageurl'] = None
+        self.write_patch(product_code, None)
 
     def parse(self, response):
-        index = response.meta['index']
         product_code = response.meta['product_code']
 
-        selectors = [
-            'picture.main-picture > img::attr(src)',
-            'picture.main-picture > source::attr(srcset)',
-            '//picture[@class="main-picture"]/img/@src',
-            '//picture[@class="main-picture"]/source[1]/@srcset',
-            '//div[@class="picture-container"]/picture/source[@media="(max-width: 599px)"]/@srcset',
-            '//div[@class="picture-container"]/picture/source[@media="(min-width: 600px and max-width: 1023px)"]/@srcset',
-            '//div[@class="picture-container"]/picture/source[@media="(min-width: 1024px) and (max-width: 1279px)"]/@srcset',
-            '//div[@class="picture-container"]/picture/source[@media="(min-width: 1280px) and (max-width: 1599px)"]/@srcset',
-            '//div[@class="picture-container"]/picture/source[@media="(min-width: 1600px)"]/@srcset',
-        ]
-        
-        age_urls = self.extract_images(response, selectors)
+        image_urls = self.extract_images(response)
 
         if not image_urls:
-            logger.warning(f"No image URLs found for product {product_code}. Retrying after 10 seconds...")
-            time.sleep(10)
-            image_urls = self.extract_images(response, selectors)
+            retry_ct = response.meta.get('retry_ct', 0)
+            if retry_ct < IMAGE_RETRY_TIMES:
+                logger.warning(f"No image URLs found for product {product_code}. Retrying ({retry_ct + 1}/{IMAGE_RETRY_TIMES})...")
+                # Request the page again instead of sleeping, so the other downloads keep going;
+                # AutoThrottle spaces it out
+                yield scrapy.Request(
+                    url=response.url,
+                    callback=self.parse,
+                    meta={'product_code': product_code, 'retry_ct': retry_ct + 1},
+                    errback=self.handle_error,
+                    dont_filter=True
+                )
+                return
+            logger.warning(f"Still no image URLs found for product {product_code} after {retry_ct} retries.")
 
-        if not image_urls:
-            logger.warning(f"Still no image URLs found for product {product_code} after retry.")
+        self.write_patch(product_code, ', '.join(image_urls) if image_urls else None)
 
-        if not self.df.empty:
-            self.df.at[index, 'imageurl'] = ', '.join(image_urls) if image_urls else None
+    def write_patch(self, product_code, image_url):
+        # One small write per product instead of touching the DataFrame
+        if self.patch_file is None:
+            self.patch_file = open(PATCH_PATH, 'ab', buffering=0)
+        self.patch_file.write(orjson.dumps({'product_code': product_code, 'imageurl': image_url},
+                                           option=orjson.OPT_APPEND_NEWLINE))
 
-    def extract_images(self, response, selectors):
-        image_urls = []
-        try:
-            for selector in selectors:
-                if '::attr' in selector:
-                    image_url = response.css(selector).get()
-                else:
-                    image_url = response.xpath(selector).get()
-
-                if image_url:
-                    logger.info(f"Image URL found: {image_url}")
-                    image_urls.append(image_url)
-        except Exception as e:
-            logger.error(f"Error extracting images: {e}")
+    def apply_patch(self):
+        """Merge the image URLs recorded in the patch file into the frame (later lines win)."""
+        self.close_patch()
+        updates = {}
+        if os.path.exists(PATCH_PATH):
+            with open(PATCH_PATH, 'rb') as f:
+                for line in f:
+                    update = orjson.loads(line)
+                    updates[update['product_code']] = update['imageurl']
+
+        if updates:
+            patched = self.df['product_code'].isin(updates.keys())
+            self.df.loc[patched, 'imageurl'] = self.df.loc[patched, 'product_code'].map(updates)
+
+    def extract_images(self, response):
+        image_urls = XPATH_IMAGES(response.selector.root)
+        if image_urls:
+            logger.debug("Image URLs found: {}", image_urls)
         return image_urls
 
+    def close_patch(self):
+        if self.patch_file is not None:
+            self.patch_file.close()
+            self.patch_file = None
+
     def closed(self, reason):
+        try:
+            self.save_updates()
+        finally:
+            self.close_patch()  # Also on the paths that never merge the patch
+
+        # Check for and handle missing URLs
+        self.check_missing_urls_and_retry()
+
+    def save_updates(self):
         if not self.df.empty:
             try:
-                updated_csv_path = 'data/updated/bloomingdales_products_updated.csv'
-                updated_excel_path = 'data/updated/bloomingdales_products_updated.xlsx'
+                self.apply_patch()
+                # Write the files side by side, so closing takes as long as the slowest write rather than the sum
+                with ThreadPoolExecutor(max_workers=3) as executor:
+                    futures = [
+                        executor.submit(self.df.to_parquet, UPDATED_PARQUET_PATH, index=False, compression='zstd'),
+                        executor.submit(self.df.to_csv, UPDATED_CSV_PATH, index=False),
+                    ]
+                    # openpyxl is slow on large frames, so the Excel copy is opt-in
+                    if os.environ.get('EXPORT_XLSX'):
+                        futures.append(executor.submit(self.df.to_excel, UPDATED_EXCEL_PATH, index=False))
+                    for future in futures:
+                        future.result()  # Re-raise a failed write
 
-                self.df.to_csv(updated_csv_path, index=False)
-                self.df.to_excel(updated_excel_path, index=False)
+                logger.info(f"Scraping complete. Data saved to {UPDATED_PARQUET_PATH} and {UPDATED_CSV_PATH}.")
 
-                logger.info(f"Scraping complete. Data saved to {updated_csv_path} and {updated_excel_path}.")
+                # Everything in the patch is now part of the saved files
+                if os.path.exists(PATCH_PATH):
+                    os.remove(PATCH_PATH)
             except Exception as e:
                 logger.error(f"Error saving updated files: {e}")
         else:
             logger.error("DataFrame is empty, nothing to save.")
 
-        # Check for and handle missing URLs
-        self.check_missing_urls_and_retry()
-
     def check_missing_urls_and_retry(self):
         try:
-            updated_df = pd.read_excel('data/updated/bloomingdales_products_updated.xlsx')
+            updated_df = pd.read_parquet(UPDATED_PARQUET_PATH)
             missing_image_urls_df = updated_df[updated_df['imageurl'].isnull() | updated_df['imageurl'].eq('')]
 
-            if not missing_image_urls_df.empty:
-                logger.warning(f"Found {len(missing_image_urls_df)} products with missing image URLs. Retrying...")
-                self.products_to_scrape = missing_image_urls_df
-                process.crawl(BloomingdalesImageScraper)
-                process.start(stop_after_crawl=False)
+            if not missing_image_urls_df.empty and (process is None or self.retry_round >= MISSING_URL_RETRY_ROUNDS):
+                logger.warning(f"Found {len(missing_image_urls_df)} products with missing image URLs. Not retrying.")
+            elif not missing_image_urls_df.empty:
+                logger.warning(f"Found {len(missing_image_urls_df)} products with missing image URLs. "
+                               f"Retrying ({self.retry_round + 1}/{MISSING_URL_RETRY_ROUNDS})...")
+                # The reactor is still running, so the crawl starts as soon as it is scheduled
+                process.crawl(BloomingdalesImageScraper, retry_round=self.retry_round + 1)
             else:
                 logger.info("All products have image URLs. No need to retry.")
         except Exception as e:
@@ -162,7 +259,7 @@ class BloomingdalesImageScraper(scrapy.Spider):
 
 if __name__ == "__main__":
     process = CrawlerProcess(settings={
-        'LOG_LEVEL': 'DEBUG',
+        'LOG_LEVEL': LOG_LEVEL,
         'USER_AGENT': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
     })
 
@@ -0,0 +1,11 @@
+# Helpers for the compiled lxml XPaths of both spiders
+
+
+def has_class(*names):
+    """XPath predicate true for elements whose class attribute contains every given class."""
+    return ' and '.join(f'contains(concat(" ", normalize-space(@class), " "), " {name} ")' for name in names)
+
+
+def first(results):
+    """Return the first result of a compiled XPath call, or None."""
+    return results[0] if results else None
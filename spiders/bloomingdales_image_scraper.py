@@ -56,15 +56,13 @@ class BloomingdalesImageScraper(scrapy.Spider):
             logger.warning("No products to scrape. Stopping spider.")
             return
 
-        for index, row in self.products_to_scrape.iterrows():
-            product_url = row['itemurl']
-            product_code = row['product_code']
-            
-            logger.debug(f"Processing product: {product_code}, URL: {product_url}")
+        # Plain column arrays instead of a Series per row; relative URLs are prefixed in one pass
+        urls = self.products_to_scrape['itemurl']
+        urls = urls.where(urls.str.startswith('http', na=True), base_url + urls)
 
-            if not product_url.startswith('http'):
-                product_url = base_url + product_url
-                logger.debug(f"Updated relative URL to: {product_url}")
+        for index, product_url, product_code in zip(self.products_to_scrape.index.to_numpy(), urls.to_numpy(),
+                                                    self.products_to_scrape['product_code'].to_numpy()):
+            logger.debug(f"Processing product: {product_code}, URL: {product_url}")
 
             yield scrapy.Request(
                 url=product_url,